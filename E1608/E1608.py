@@ -9,8 +9,7 @@ Created on Sun Mar 24 18:51:06 2024
 
 from __future__ import absolute_import, division, print_function, annotations
 # from builtins import *
-from ctypes import c_double, cast, POINTER, addressof, sizeof
-from time import sleep
+from ctypes import c_ushort, cast, POINTER
 from mcculw import ul
 from mcculw.enums import (ScanOptions, FunctionType, Status, AnalogInputMode,
                           InterfaceType, ULRange)
@@ -18,15 +17,61 @@ import csv
 import os
 import sys
 import datetime
+import gc
+import io
 import logging
+import queue
 import threading
 import numpy as np
 import pandas as pd
 
+from ._kernels import copy_chunk, counts_to_volts, deinterleave_index
+
+
+def _set_realtime(cpu):
+    """Pin the calling thread to one CPU and raise its scheduling priority.
+
+    Best effort: on Linux SCHED_FIFO needs CAP_SYS_NICE (or root); without
+    it only the pinning is applied.
+
+    Parameters
+    ----------
+    cpu : int
+        Index of the CPU core to run on.
+
+    Returns
+    -------
+    None.
+
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        thread = kernel32.GetCurrentThread()
+        kernel32.SetThreadAffinityMask(thread, 1 << cpu)
+        kernel32.SetThreadPriority(thread, 15)  # THREAD_PRIORITY_TIME_CRITICAL
+        return
+
+    # pid 0 is the calling thread
+    try:
+        os.sched_setaffinity(0, {cpu})
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(1))
+    except (AttributeError, OSError):
+        pass
+
 
 class E1608(object):
 
-    def __init__(self, channels, rate=10000, dur=1, board_num=0):
+    # shared by all instances: device inventory, and the number of open
+    # instances using each board added to the UL
+    _inventory = None
+    _board_users = {}
+
+    def __init__(self, channels, rate=10000, dur=1, board_num=0, max_dur=None,
+                 realtime_cpu=None):
         """Initialize parameters.
 
         Parameters
@@ -47,6 +92,16 @@ class E1608(object):
 
         board_num: int, required
             Index of board to select in the case of multiple boards detected on network
+
+        max_dur : float, optional
+            Seconds of data to keep in memory. Once full, the oldest samples
+            are overwritten. The default is None, which keeps everything.
+
+        realtime_cpu : int, optional
+            CPU core to pin the acquisition thread to. The thread also gets
+            real-time priority (needs CAP_SYS_NICE on Linux) and garbage
+            collection is disabled while it runs. The default is None, which
+            leaves scheduling alone.
             
 
 
@@ -57,6 +112,7 @@ class E1608(object):
         """
         # ******* device info *******
         self.board_num = board_num
+        self._has_board = False
         self.dev_id_list = []
         self.low_chan = 0
         self.high_chan = None
@@ -81,14 +137,33 @@ class E1608(object):
         self.dur = dur
         self.file_name = None
         self.channels = channels  # User-defined channels
-        self.channel_data = [[] for _ in range(len(channels)*2)]
+        self.max_dur = max_dur
+        self.realtime_cpu = realtime_cpu
+        self._df = None
+        self._columns = None
+        self._channel_data = None
+
+        # ring buffer of samples: (channel, sample), filled in setup
+        self._ring = np.empty((len(channels)*2, 0), dtype=np.uint16)
+        self._wpos = 0
+        self._total_written = 0
 
         # self.logging_initialized = False
         self.thread = None
         self.stop_event = threading.Event()
+        self.scan_params = {}
+
+        # chunks copied out of the UL buffer, waiting to go into the ring
+        self._consumer_thread = None
+        self._chunk_queue = queue.SimpleQueue()
+
+        # optional csv writer fed by the consumer
+        self._writer_thread = None
+        self._write_queue = None
+        self._writer_error = None
         
         # run setup and device detection
-        self._device_detection(self.board_num)
+        self._device_detection()
 
     def _device_detection(self, dev_id_list=None):
         """Add the first available device to the UL.
@@ -106,8 +181,7 @@ class E1608(object):
                         Default is None.
                         See UL documentation for device IDs.
         """
-        ul.ignore_instacal()
-        devices = ul.get_daq_device_inventory(InterfaceType.ANY)
+        devices = self._get_inventory()
         if not devices:
             raise IOError('Error: No DAQ devices found')
 
@@ -128,8 +202,28 @@ class E1608(object):
                 err_str += ','.join(str(dev_id) for dev_id in dev_id_list)
                 raise RuntimeError(err_str)
 
-        # Add the first DAQ device to the UL with the specified board number
-        ul.create_daq_device(self.board_num, device)
+        # Add the first DAQ device to the UL with the specified board number,
+        # unless another instance already did
+        users = E1608._board_users.get(self.board_num, 0)
+        if not users:
+            ul.create_daq_device(self.board_num, device)
+        E1608._board_users[self.board_num] = users + 1
+        self._has_board = True
+
+    @classmethod
+    def _get_inventory(cls):
+        """List the DAQ devices on the network, scanning until one is found.
+
+        Returns
+        -------
+        list
+            Device descriptors from ul.get_daq_device_inventory.
+
+        """
+        if not cls._inventory:
+            ul.ignore_instacal()
+            cls._inventory = ul.get_daq_device_inventory(InterfaceType.ANY)
+        return cls._inventory
 
     def setup(self):
         """Connect to necessary equipment and setup any necessary parameters.
@@ -145,6 +239,10 @@ class E1608(object):
 
         """
 
+        # add the device again if close() released it
+        if not self._has_board:
+            self._device_detection()
+
         # set device to "Single Ended" mode. Other optin is "Differential"
         ul.a_input_mode(self.board_num, AnalogInputMode.SINGLE_ENDED)
 
@@ -158,26 +256,70 @@ class E1608(object):
         points_per_channel = max(self.rate * self.dur, 10)
 
         # Total points
-        ul_buffer_count = points_per_channel * self.num_chan*2
+        self._n_ch = self.high_chan - self.low_chan + 1
+        buffer_target = points_per_channel * self._n_ch
 
         # Write the UL buffer to the file num_buffers_to_write times.
         # points_to_write = ul_buffer_count * self.num_buffers_to_write
 
-        # When handling the buffer, we will read 1/10 of the buffer at a time
-        write_chunk_size = int(ul_buffer_count / 10)
+        # When handling the buffer, we will read about 1/10 of the buffer at
+        # a time. The device transfers blocks of 128 samples per channel, so
+        # use whole blocks: each chunk is then whole scans starting on
+        # low_chan, and is never a partial transfer
+        block_size = 128 * self._n_ch
+        write_chunk_size = max(block_size,
+                               buffer_target // 10 // block_size * block_size)
 
-        # AI range set to +/- 10 volts which is its max.
-        ai_range = ULRange.BIP10VOLTS
+        # Round the buffer up to a whole number of chunks, and at least 10.
+        # Chunks then never straddle the end of the UL buffer, so no read has
+        # to be split
+        ul_buffer_count = write_chunk_size * max(
+            -(-buffer_target // write_chunk_size), 10)
+        assert ul_buffer_count % write_chunk_size == 0
+
+        # Index table taking an interleaved chunk to channel-major order
+        self._deinterleave = deinterleave_index(write_chunk_size, self._n_ch)
 
-        # The SCALEDATA option, returns volts instead of A/D counts
-        scan_options = (ScanOptions.BACKGROUND | ScanOptions.CONTINUOUS |
-                        ScanOptions.SCALEDATA)
+        # Poll for new data a few times per chunk, scaled to the sample rate
+        self._poll_interval = max(5e-4, 0.25 * write_chunk_size /
+                                  (self.rate * self._n_ch))
 
-        memhandle = ul.scaled_win_buf_alloc(ul_buffer_count)
+        # AI range set to +/- 10 volts which is its max.
+        ai_range = ULRange.BIP10VOLTS
 
-        # Check if the buffer was successfully allocated
-        if not memhandle:
-            raise MemoryError('Failed to allocate memory')
+        # Keep raw 16-bit A/D counts, a quarter of the size of scaled doubles.
+        # to_volts converts them when needed
+        scan_options = ScanOptions.BACKGROUND | ScanOptions.CONTINUOUS
+
+        # counts to volts is linear: volts = counts * gain + offset
+        self._offset = ul.to_eng_units(self.board_num, ai_range, 0)
+        self._gain = (ul.to_eng_units(self.board_num, ai_range, 0xFFFF) -
+                      self._offset) / 0xFFFF
+
+        # Reuse the UL buffer from the last run if its size is unchanged
+        memhandle = self.scan_params.get('memhandle')
+        if self.scan_params.get('ul_buffer_count') != ul_buffer_count:
+            self._free_buffer()
+            memhandle = ul.win_buf_alloc(ul_buffer_count)
+
+            # Check if the buffer was successfully allocated
+            if not memhandle:
+                raise MemoryError('Failed to allocate memory')
+
+            # The UL buffer holds 16-bit counts: read it in place
+            self._ul_view = np.ctypeslib.as_array(
+                cast(memhandle, POINTER(c_ushort)), shape=(ul_buffer_count,))
+
+        # Preallocate the ring buffer, sized to max_dur or grown as needed.
+        # Always a new one: data from the last run may still be in use
+        if self.max_dur is None:
+            capacity = points_per_channel * 10
+        else:
+            capacity = max(int(self.rate * self.max_dur),
+                           write_chunk_size // self._n_ch)
+        self._ring = np.empty((self._n_ch, capacity), dtype=np.uint16)
+        self._wpos = 0
+        self._total_written = 0
 
         self.scan_params = {
             'ul_buffer_count': ul_buffer_count,
@@ -185,9 +327,37 @@ class E1608(object):
             'write_chunk_size': write_chunk_size,
             'ai_range': ai_range,
             'scan_options': scan_options,
-            'memhandle': memhandle
+            'memhandle': memhandle,
         }
 
+    def _free_buffer(self):
+        """Free the UL buffer, if any"""
+        memhandle = self.scan_params.get('memhandle')
+        if memhandle:
+            ul.win_buf_free(memhandle)
+        self.scan_params = {}
+        self._ul_view = None
+
+    def close(self):
+        """Free the UL buffer and release the device from the UL.
+
+        Both are otherwise kept for the next start(). The device is only
+        released once every instance using it is closed. Calling start()
+        after close() adds the device again.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._free_buffer()
+        if self._has_board:
+            self._has_board = False
+            E1608._board_users[self.board_num] -= 1
+            if not E1608._board_users[self.board_num]:
+                del E1608._board_users[self.board_num]
+                ul.release_daq_device(self.board_num)
+
     def _initialize_logging(self):
         """Set up the logging configuration for the DataAcquisition class,
         defining the logging level, format, and output stream for log messages.
@@ -205,17 +375,108 @@ class E1608(object):
             self.logger = logging.getLogger('DataAcquisition')
             self.logging_initialized = True
 
+    @property
+    def channel_data(self):
+        """Voltages in acquisition order, indexed as [channel, sample]. Cached
+        until more data arrives"""
+        # keyed on the write cursor, as in _get_columns
+        key = (self._total_written, self._wpos)
+        if self._channel_data is None or self._channel_data[0] != key:
+            self._channel_data = (key, self.to_volts(self._ordered(*key)))
+        return self._channel_data[1]
+
+    @property
+    def counts(self):
+        """Raw A/D counts in acquisition order, indexed as [channel, sample].
+        See to_volts"""
+        return self._ordered(self._total_written, self._wpos)
+
+    def _ordered(self, total, wpos):
+        """Ring contents in acquisition order, as of the given write cursor"""
+        ring = self._ring
+        if total <= ring.shape[1]:
+            return ring[:, :total]
+        return np.roll(ring, -wpos, axis=1)
+
+    def to_volts(self, counts=None):
+        """Convert A/D counts to volts.
+
+        Parameters
+        ----------
+        counts : np.ndarray, optional
+            Counts to convert. The default is all of self.counts.
+
+        Returns
+        -------
+        np.ndarray
+            Voltages as float32, same shape as counts.
+
+        """
+        if counts is None:
+            counts = self.counts
+
+        # the scale is only known once setup() has run
+        if not counts.size:
+            return counts.astype(np.float32)
+        return counts_to_volts(counts, self._gain, self._offset)
+
     def clear(self):
         """Reset all saved data"""
-        try:
-            del self.df
-        except AttributeError:
-            pass
-        self.channel_data = [[] for _ in range(len(self.channels)*2)]
+        self._df = None
+        self._columns = None
+        self._channel_data = None
+        self._wpos = 0
+        self._total_written = 0
+
+    def _write_ring(self, chunk):
+        """Copy a chunk of interleaved samples into the ring buffer.
 
-    def start(self):
+        Parameters
+        ----------
+        chunk : np.ndarray
+            Samples as read from the UL buffer, a whole number of scans.
+
+        Returns
+        -------
+        None.
+
+        """
+        n = chunk.size // self._n_ch
+        capacity = self._ring.shape[1]
+
+        # no length limit: grow instead of wrapping. Size on the total, not
+        # _wpos, which is back at 0 when the last chunk ended at capacity
+        total = self._total_written
+        if self.max_dur is None and total + n > capacity:
+            while total + n > capacity:
+                capacity *= 2
+            ring = np.empty((self._ring.shape[0], capacity),
+                            dtype=self._ring.dtype)
+            ring[:, :total] = self._ring[:, :total]
+            self._ring = ring
+            self._wpos = total
+
+        # gather each channel's samples into its own contiguous row
+        block = chunk.take(self._deinterleave).reshape(self._n_ch, n)
+        self._wpos = copy_chunk(block, self._ring, self._wpos)
+        self._total_written += n
+
+    def start(self, filename=None, fmt='%.6g', **setting):
         """Start data acquisition.
 
+        Parameters
+        ----------
+        filename : str, optional
+            If given, also write the data to this csv file while acquiring,
+            from a separate thread, in the same layout as to_csv. Unlike
+            to_csv, the file keeps every sample even once max_dur is
+            reached. The default is None.
+        fmt : str, optional
+            printf-style format of the channel values written to filename.
+            The default is '%.6g'.
+        setting : dict
+            Additional settings to include in the header of filename.
+
         Returns
         -------
         None.
@@ -224,12 +485,34 @@ class E1608(object):
         self.stop_event.clear()  # Reset stop event
         self.clear()
         self.setup()
+
+        # bounded, so a slow disk holds up the consumer but never the UL poll
+        self._writer_thread = None
+        self._write_queue = None
+        self._writer_error = None
+        if filename is not None:
+            # opened here so a bad path raises to the caller
+            csvfile = open(filename, 'wb')
+            self._write_queue = queue.Queue(maxsize=64)
+            self._writer_thread = threading.Thread(
+                target=self._stream_to_csv, args=(csvfile, fmt, setting))
+            self._writer_thread.start()
+
+        self._chunk_queue = queue.SimpleQueue()
+        self._consumer_thread = threading.Thread(target=self._consume)
+        self._consumer_thread.start()
         self.thread = threading.Thread(target=self._acquire_data)
         self.thread.start()
 
     def stop(self):
         """Stop data acquisition.
 
+        Raises
+        ------
+        Exception
+            Whatever stopped the csv writer, if start() was given a filename
+            and writing failed. The acquired data is kept regardless.
+
         Returns
         -------
         None.
@@ -237,7 +520,85 @@ class E1608(object):
         """
         self.stop_event.set()
         self.thread.join()
-        self.to_df()
+
+        # let the consumer finish the queued chunks
+        self._chunk_queue.put(None)
+        self._consumer_thread.join()
+        if self._writer_thread is not None:
+            self._writer_thread.join()
+            if self._writer_error is not None:
+                error, self._writer_error = self._writer_error, None
+                raise error
+
+    def _consume(self):
+        """Move chunks from the queue into the ring buffer.
+
+        Runs in its own thread until a None is queued, so polling the UL
+        never waits on the copy.
+
+        Returns
+        -------
+        None.
+
+        """
+        while True:
+            chunk = self._chunk_queue.get()
+            if chunk is None:
+                break
+            start = self._total_written
+            self._write_ring(chunk)
+            if self._write_queue is not None:
+                self._write_queue.put((start, chunk))
+
+        if self._write_queue is not None:
+            self._write_queue.put(None)
+
+    def _stream_to_csv(self, csvfile, fmt, setting):
+        """Append chunks from the write queue to a csv file.
+
+        Runs in its own thread until a None is queued. If writing fails, the
+        error is kept for stop() to raise and the queue is still drained, so
+        the consumer never blocks.
+
+        Parameters
+        ----------
+        csvfile : file
+            Binary file to write to, closed when done.
+        fmt : str
+            printf-style format of the channel values.
+        setting : dict
+            Additional settings to include in the header.
+
+        Returns
+        -------
+        None.
+
+        """
+        row_fmt = ['%.15g'] + [fmt]*self.num_chan
+        sample_period = 1 / self.rate
+
+        item = ()
+        try:
+            with csvfile:
+                csvfile.write(self._csv_header(setting))
+                while True:
+                    item = self._write_queue.get()
+                    if item is None:
+                        break
+                    start, chunk = item
+
+                    # one row per scan, high channels only
+                    volts = self.to_volts(
+                        chunk.reshape(-1, self._n_ch)[:, ::2])
+                    time_array = np.arange(
+                        start, start + len(volts))*sample_period
+                    np.savetxt(csvfile, np.column_stack([time_array, volts]),
+                               fmt=row_fmt, delimiter=',')
+        except Exception as error:
+            self._writer_error = error
+        finally:
+            while item is not None:
+                item = self._write_queue.get()
 
     def _acquire_data(self):
         """Start the scan and acquire data.
@@ -247,123 +608,106 @@ class E1608(object):
         None.
 
         """
-        ul.a_in_scan(self.board_num, self.low_chan, self.high_chan,
-                     self.scan_params['ul_buffer_count'],
-                     self.rate, self.scan_params['ai_range'],
-                     self.scan_params['memhandle'],
+        if self.realtime_cpu is not None:
+            _set_realtime(self.realtime_cpu)
+            gc.disable()
+
+        try:
+            self._run_scan()
+        finally:
+            if self.realtime_cpu is not None:
+                gc.enable()
+
+            # no more chunks: release the consumer
+            self._chunk_queue.put(None)
+
+    def _run_scan(self):
+        """Run the scan and queue each chunk read from the UL buffer.
+
+        Returns
+        -------
+        None.
+
+        """
+        # Bind everything the loop touches to locals once
+        board = self.board_num
+        ul_buffer_count = self.scan_params['ul_buffer_count']
+        chunk_size = self.scan_params['write_chunk_size']
+        memhandle = self.scan_params['memhandle']
+        ai_range = self.scan_params['ai_range']
+        ul_view = self._ul_view
+        put = self._chunk_queue.put
+        is_stopped = self.stop_event.is_set
+        wait = self.stop_event.wait
+        poll_interval = self._poll_interval
+        # UL calls go through ctypes, which drops the GIL while they run, so
+        # the consumer thread keeps working during each poll
+        get_status = ul.get_status
+        ai_function = FunctionType.AIFUNCTION
+
+        ul.a_in_scan(board, self.low_chan, self.high_chan, ul_buffer_count,
+                     self.rate, ai_range, memhandle,
                      self.scan_params['scan_options'])
 
         status = Status.IDLE
-        # Wait for the scan to start fully
-        while status == Status.IDLE:
+        # Wait for the scan to start fully, unless stop() comes first.
+        # Sleep between polls rather than spinning on the UL
+        while status == Status.IDLE and not wait(1e-3):
             # Get the status from the device
-            status, _, _ = ul.get_status(
-                self.board_num, FunctionType.AIFUNCTION)
+            status, _, _ = get_status(board, ai_function)
 
         # Start the write loop
         prev_count = 0
         prev_index = 0
-        write_ch_num = self.low_chan
-        write_chunk_array = (c_double * self.scan_params['write_chunk_size'])()
 
         while status != Status.IDLE:
             # Check if the stop event has been set
-            if self.stop_event.is_set():
+            if is_stopped():
                 break  # Exit the loop if stop event is set
 
             # Get the latest counts
-            status, curr_count, _ = ul.get_status(
-                self.board_num, FunctionType.AIFUNCTION)
+            status, curr_count, _ = get_status(board, ai_function)
 
             new_data_count = curr_count - prev_count
 
-            # Check for a buffer overrun before copying the data
-            if new_data_count > self.scan_params['ul_buffer_count']:
+            # Check for a buffer overrun before copying the data. Leave a
+            # chunk of margin: the device keeps writing during the copy, and
+            # a chunk it laps mid-copy is not caught on a later poll
+            if new_data_count > ul_buffer_count - chunk_size:
                 # Print an error and stop writing
-                ul.stop_background(self.board_num, FunctionType.AIFUNCTION)
+                ul.stop_background(board, ai_function)
                 print('A buffer overrun occurred')
                 break
 
             # Check if a chunk is available
-            if new_data_count > self.scan_params['write_chunk_size']:
+            if new_data_count > chunk_size:
                 wrote_chunk = True
-                # Copy the current data to a new array
-
-                # Check if the data wraps around the end of the UL buffer
-                if prev_index + self.scan_params['write_chunk_size'] > \
-                        self.scan_params['ul_buffer_count'] - 1:
-
-                    first_chunk_size = self.scan_params['ul_buffer_count'] - \
-                        prev_index
-
-                    second_chunk_size = (
-                        self.scan_params['write_chunk_size'] -
-                        first_chunk_size)
-
-                    # Copy the first chunk of data to the write_chunk_array
-                    ul.scaled_win_buf_to_array(self.scan_params['memhandle'],
-                                               write_chunk_array, prev_index,
-                                               first_chunk_size)
-
-                    # Create a pointer to the location in write_chunk_array where we want to copy the remaining data
-                    second_chunk_pointer = cast(addressof(write_chunk_array)
-                                                + first_chunk_size
-                                                * sizeof(c_double),
-                                                POINTER(c_double))
-
-                    # Copy the second chunk of data to the write_chunk_array
-                    ul.scaled_win_buf_to_array(self.scan_params['memhandle'],
-                                               second_chunk_pointer, 0,
-                                               second_chunk_size)
-                else:
-                    # Copy the data to the write_chunk_array
-                    ul.scaled_win_buf_to_array(
-                        self.scan_params['memhandle'], write_chunk_array,
-                        prev_index, self.scan_params['write_chunk_size'])
-
-                # Check for a buffer overrun just after copying the data from the UL buffer
-                status, curr_count, _ = ul.get_status(
-                    self.board_num, FunctionType.AIFUNCTION)
-
-                if curr_count - prev_count > \
-                        self.scan_params['ul_buffer_count']:
-                    # Print an error and stop writing
-                    ul.stop_background(self.board_num, FunctionType.AIFUNCTION)
-                    print('A buffer overrun occurred')
-                    break
 
-                for i in range(self.scan_params['write_chunk_size']):
-                    # Append data to corresponding channel array
-                    self.channel_data[write_ch_num].append(
-                        write_chunk_array[i])
-                    write_ch_num += 1
-                    if write_ch_num == self.high_chan + 1:
-                        write_ch_num = self.low_chan
+                # The UL buffer holds a whole number of chunks (see setup),
+                # so the chunk never wraps around its end
+                put(ul_view[prev_index:prev_index + chunk_size].copy())
             else:
                 wrote_chunk = False
 
             if wrote_chunk:
                 # Increment prev_count by the chunk size
-                prev_count += self.scan_params['write_chunk_size']
+                prev_count += chunk_size
 
                 # Increment prev_index by the chunk size
-                prev_index += self.scan_params['write_chunk_size']
+                prev_index += chunk_size
 
                 # Wrap prev_index to the size of the UL buffer
-                prev_index %= self.scan_params['ul_buffer_count']
+                prev_index %= ul_buffer_count
 
                 # if prev_count >= self.scan_params['points_to_write']:
                 #     break
-                # print('.', end='')
             else:
-                # Wait a short amount of time for more data to be acquired.
-                sleep(0.1)
-
-        ul.stop_background(self.board_num, FunctionType.AIFUNCTION)
+                # Wait a short amount of time for more data to be acquired,
+                # returning early if stop() is called
+                if wait(poll_interval):
+                    break
 
-        # Free the buffer in a finally block to prevent a memory leak.
-        if self.scan_params['memhandle']:
-            ul.win_buf_free(self.scan_params['memhandle'])
+        ul.stop_background(board, ai_function)
 
     def generate_file_name(self, directory):
         """Automatically generates file name based on the date of creation.
@@ -385,38 +729,107 @@ class E1608(object):
         file_path = os.path.join(directory, f"data_{current_datetime}.csv")
         self.file_name = file_path
 
-    def to_df(self):
-        # Create a time array
-        num_samples = len(self.channel_data[0])  # Assuming all channels have the same length
-        sample_period = 1 / self.rate
-        time_array = np.arange(0, num_samples)*sample_period
+    def _get_columns(self):
+        """Get the labelled channels and their time axis. Cached until more
+        data arrives.
+
+        Returns
+        -------
+        tuple
+            (channel labels, time array, [channel, sample] array of volts)
+
+        """
+        # keyed on the write cursor, which only the consumer moves: a build
+        # racing a new chunk is then rebuilt on the next call
+        key = (self._total_written, self._wpos)
+        if self._columns is not None and self._columns[0] == key:
+            return self._columns[1]
+
+        # high channels only: the ring holds whole scans, so every channel
+        # has the same length
+        total, wpos = key
+        columns = self.to_volts(self._ordered(total, wpos)[::2])
 
         # Create channel labels
         channel_labels = [self.channels.get(
             i, f"CH{i}") for i in range(self.num_chan)]
 
-        # Create dict for DataFrame
-        data_dict = {"Time (s)": time_array}
-        for i, label in enumerate(channel_labels):
-            data_dict[label] = self.channel_data[i*2]
+        # Create a time array, starting at the oldest sample still kept
+        sample_period = 1 / self.rate
+        time_array = np.arange(total - columns.shape[1], total)*sample_period
+
+        self._columns = (key, (channel_labels, time_array, columns))
+        return self._columns[1]
+
+    @property
+    def df(self):
+        """Acquired data as a DataFrame indexed by time, built on first use"""
+        return self.to_df()
+
+    def to_df(self):
+        """Convert the acquired data to a DataFrame. Cached until more data
+        arrives.
+
+        Returns
+        -------
+        pd.DataFrame
+            One column per channel, indexed by time in seconds.
+
+        """
+        key = (self._total_written, self._wpos)
+        if self._df is not None and self._df[0] == key:
+            return self._df[1]
+
+        channel_labels, time_array, columns = self._get_columns()
+
+        # wrap the samples without another copy
+        df = pd.DataFrame(columns.T,
+                          index=pd.Index(time_array, name='Time (s)'),
+                          columns=channel_labels, copy=False)
+        self._df = (key, df)
+        return df
+
+    def _csv_header(self, setting):
+        """Header of the csv files: the settings, then the column labels.
 
-        # get shortest list and trim to length
-        len_shortest = min([len(ch) for ch in data_dict.values()])
-        for key, val in data_dict.items():
-            data_dict[key] = val[:len_shortest]
+        Parameters
+        ----------
+        setting : dict
+            Additional settings to include in the header.
 
-        # make dataframe
-        self.df = pd.DataFrame(data_dict).set_index('Time (s)')
-        return self.df
+        Returns
+        -------
+        bytes
+            The header lines, utf-8 encoded. savetxt would encode its own
+            header as latin1.
 
-    def to_csv(self, filename=None, downsample=1, **setting):
+        """
+        channel_labels = [self.channels.get(
+            i, f"CH{i}") for i in range(self.num_chan)]
+
+        header = ['# Physical settings:']
+        header.extend(
+            [f'#    {key}: {value}' for key, value in setting.items()])
+        header.append('#')
+        header.append(','.join(['Time (s)'] + channel_labels))
+        return ('\n'.join(header) + '\n').encode()
+
+    def to_csv(self, filename=None, downsample=1, fmt='%.6g', **setting):
         """Save the whole data in a csv file.
 
+        Text output is slow and several times larger than the data itself.
+        Prefer to_npy or to_hdf5 for long acquisitions.
+
         Parameters
         ----------
         filename : str, optional
             The file name to save the data to. If not provided, it will use
             the automatically generated file name.
+        downsample : int, optional
+            Keep every nth sample. The default is 1.
+        fmt : str, optional
+            printf-style format of the channel values. The default '%.6g'
+            covers the 16-bit ADC resolution; use e.g. '%.15g' for more.
         setting : dict
             Additional settings to include in the header.
 
@@ -427,20 +840,74 @@ class E1608(object):
         if filename is None:
             filename = self.file_name
 
-        header = ['# Physical settings:']
-        header.extend(
-            [f'#    {key}: {value}' for key, value in setting.items()])
-        header.append('#\n')
+        _, time_array, columns = self._get_columns()
+
+        if len(time_array):
+            out = np.column_stack([time_array[::downsample],
+                                   columns[:, ::downsample].T])
+            # savetxt writes row by row: format everything in memory, then
+            # hand the file a single large write
+            buffer = io.BytesIO()
+            buffer.write(self._csv_header(setting))
+            # time keeps full precision so long runs stay resolved
+            np.savetxt(buffer, out, fmt=['%.15g'] + [fmt]*len(columns),
+                       delimiter=',')
+            with open(filename, 'wb') as csvfile:
+                csvfile.write(buffer.getbuffer())
+            print(f"Data saved to {filename} successfully.")
+        else:
+            print("No data available to save.")
+
+    def to_npy(self, filename):
+        """Save the data as a binary numpy file.
 
-        self.to_df()  # Convert channel data to DataFrame
+        Parameters
+        ----------
+        filename : str
+            The file name to save the data to.
 
-        # downsample
-        self.df = self.df.loc[::downsample]
+        Returns
+        -------
+        None.
 
-        if hasattr(self, 'df') and not self.df.empty:
-            with open(filename, 'w', newline='') as csvfile:
-                csvfile.write('\n'.join(header))
-                self.df.to_csv(csvfile, index=False)  # Save DataFrame to CSV
-            print(f"Data saved to {filename} successfully.")
-        else:
-            print("No data available to save.")
\ No newline at end of file
+        Notes
+        -----
+        The array holds volts as float32, indexed as [channel, sample], rows
+        in the order of self.channels. Column n was taken at time n/rate,
+        unless max_dur was reached and older samples were dropped: the time
+        axis is then only kept by to_df and to_csv.
+        """
+        np.save(filename, self._get_columns()[2])
+        print(f"Data saved to {filename} successfully.")
+
+    def to_hdf5(self, filename, **setting):
+        """Save the data to an HDF5 file. Requires h5py.
+
+        Parameters
+        ----------
+        filename : str
+            The file name to save the data to.
+        setting : dict
+            Additional settings stored as attributes of the dataset.
+
+        Returns
+        -------
+        None.
+
+        Notes
+        -----
+        The "data" dataset holds volts as float32, indexed as
+        [channel, sample], and is lzf-compressed. Its attributes hold the
+        channel labels and the rate.
+        """
+        import h5py
+
+        channel_labels, _, columns = self._get_columns()
+
+        with h5py.File(filename, 'w') as fid:
+            dset = fid.create_dataset('data', data=columns, compression='lzf')
+            dset.attrs['channels'] = channel_labels
+            dset.attrs['rate'] = self.rate
+            for key, value in setting.items():
+                dset.attrs[key] = value
+        print(f"Data saved to {filename} successfully.")
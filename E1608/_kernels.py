@@ -0,0 +1,114 @@
+"""
+Compiled inner loops for moving samples out of the UL buffer and scaling
+them to volts.
+
+Numba is optional: without it the same functions run as plain numpy.
+"""
+
+import threading
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+
+def deinterleave_index(chunk_size, n_ch):
+    """Index table taking an interleaved chunk to channel-major order.
+
+    Parameters
+    ----------
+    chunk_size : int
+        Samples per chunk, a whole number of scans.
+    n_ch : int
+        Channels per scan.
+
+    Returns
+    -------
+    np.ndarray
+        Indices such that chunk.take(index).reshape(n_ch, -1) is indexed as
+        [channel, sample].
+    """
+    return np.arange(chunk_size).reshape(-1, n_ch).T.ravel()
+
+
+def copy_chunk(block, ring, wpos):
+    """Copy one deinterleaved chunk into the ring buffer.
+
+    Parameters
+    ----------
+    block : np.ndarray
+        Samples indexed as [channel, sample].
+    ring : np.ndarray
+        Ring buffer indexed as [channel, sample].
+    wpos : int
+        Column of ring to start writing at.
+
+    Returns
+    -------
+    int
+        Write position after the chunk.
+    """
+    capacity = ring.shape[1]
+
+    end = wpos + block.shape[1]
+    if end <= capacity:
+        ring[:, wpos:end] = block
+    else:
+        first = capacity - wpos
+        ring[:, wpos:] = block[:, :first]
+        ring[:, :end - capacity] = block[:, first:]
+
+    return end % capacity
+
+
+# Compile at import with an explicit signature so the first chunk of an
+# acquisition does not wait for the JIT
+if njit is not None:
+    copy_chunk = njit('i8(u2[:, ::1], u2[:, ::1], i8)',
+                      cache=True)(copy_chunk)
+
+
+def counts_to_volts(counts, gain, offset):
+    """Convert A/D counts to volts as counts * gain + offset.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Unsigned 16-bit counts.
+    gain : float
+        Volts per count.
+    offset : float
+        Volts at count 0.
+
+    Returns
+    -------
+    np.ndarray
+        Voltages as float32, same shape as counts.
+    """
+    gain = np.float32(gain)
+    offset = np.float32(offset)
+
+    if njit is None or counts.ndim != 2:
+        return counts.astype(np.float32) * gain + offset
+
+    out = np.empty(counts.shape, dtype=np.float32)
+    # numba's default threading layer is not threadsafe, and the csv writer
+    # converts from its own thread
+    with _scale_lock:
+        _scale_counts(counts, out, gain, offset)
+    return out
+
+
+_scale_lock = threading.Lock()
+
+if njit is not None:
+    # compiled at import like copy_chunk, so the first conversion does not
+    # wait for the JIT. counts may be a strided view
+    @njit('void(u2[:, :], f4[:, ::1], f4, f4)', parallel=True, cache=True)
+    def _scale_counts(counts, out, gain, offset):
+        for i in range(counts.shape[0]):
+            for j in prange(counts.shape[1]):
+                out[i, j] = counts[i, j] * gain + offset
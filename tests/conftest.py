@@ -0,0 +1,70 @@
+"""
+Stand-in for the mcculw driver, so E1608 can be imported and its data
+handling tested without a device. Nothing here starts a scan.
+"""
+
+import ctypes
+import enum
+import sys
+import types
+
+import pytest
+
+
+class _Device(object):
+    product_name = 'E-1608'
+    unique_id = 'TEST'
+    product_id = 0
+
+
+def _make_ul():
+    ul = types.ModuleType('mcculw.ul')
+    ul.buffers = {}
+    ul.created = []
+    ul.released = []
+
+    def win_buf_alloc(count):
+        buffer = (ctypes.c_ushort * count)()
+        memhandle = ctypes.addressof(buffer)
+        ul.buffers[memhandle] = buffer
+        return memhandle
+
+    ul.ignore_instacal = lambda: None
+    ul.get_daq_device_inventory = lambda interface: [_Device()]
+    ul.create_daq_device = lambda board, device: ul.created.append(board)
+    ul.release_daq_device = lambda board: ul.released.append(board)
+    ul.a_input_mode = lambda board, mode: None
+    ul.to_eng_units = lambda board, ai_range, count: count*20/65536 - 10
+    ul.win_buf_alloc = win_buf_alloc
+    ul.win_buf_free = lambda memhandle: ul.buffers.pop(memhandle)
+    return ul
+
+
+def _make_enums():
+    enums = types.ModuleType('mcculw.enums')
+    enums.ScanOptions = enum.IntFlag('ScanOptions', 'BACKGROUND CONTINUOUS')
+    enums.FunctionType = enum.IntEnum('FunctionType', 'AIFUNCTION')
+    enums.Status = enum.IntEnum('Status', 'IDLE RUNNING', start=0)
+    enums.AnalogInputMode = enum.IntEnum('AnalogInputMode', 'SINGLE_ENDED')
+    enums.InterfaceType = enum.IntEnum('InterfaceType', 'ANY')
+    enums.ULRange = enum.IntEnum('ULRange', 'BIP10VOLTS')
+    return enums
+
+
+# installed before any test module imports E1608
+_mcculw = types.ModuleType('mcculw')
+_mcculw.ul = _make_ul()
+_mcculw.enums = _make_enums()
+sys.modules.update({'mcculw': _mcculw, 'mcculw.ul': _mcculw.ul,
+                    'mcculw.enums': _mcculw.enums})
+
+
+@pytest.fixture
+def ul():
+    """The stub driver, with a fresh device inventory and board counts"""
+    from E1608 import E1608
+
+    E1608._inventory = None
+    E1608._board_users.clear()
+    del _mcculw.ul.created[:], _mcculw.ul.released[:]
+    return _mcculw.ul
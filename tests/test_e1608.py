@@ -0,0 +1,175 @@
+"""
+Tests for the data handling of E1608, run against the stub driver in
+conftest.py: chunks are fed to the ring buffer directly, no scan is started.
+"""
+
+import queue
+
+import numpy as np
+
+from E1608 import E1608
+
+
+def _samples(n_ch, first, last):
+    """Counts of samples first to last, indexed as [channel, sample]"""
+    k = np.arange(first, last)
+    return ((k + 1000*np.arange(n_ch)[:, None]) % 65536).astype(np.uint16)
+
+
+def _feed(daq, n_chunks):
+    """Write n_chunks interleaved chunks, continuing from the last one"""
+    n = daq.scan_params['write_chunk_size'] // daq._n_ch
+    for _ in range(n_chunks):
+        start = daq._total_written
+        daq._write_ring(_samples(daq._n_ch, start, start + n).T.ravel())
+
+
+def test_ring_grows_after_exact_fill(ul):
+    daq = E1608(channels={0: 'a'}, rate=12800)
+    daq.setup()
+    n = daq.scan_params['write_chunk_size'] // daq._n_ch
+    capacity = daq._ring.shape[1]
+
+    # a chunk ends exactly at the end of the ring, leaving _wpos at 0
+    assert capacity % n == 0
+    _feed(daq, capacity // n + 50)
+
+    total = capacity + 50*n
+    assert daq._total_written == total
+    assert daq._ring.shape[1] >= total
+    np.testing.assert_array_equal(daq.counts, _samples(2, 0, total))
+
+
+def test_ring_grows_unbounded(ul):
+    daq = E1608(channels={0: 'a', 1: 'b'}, rate=10000)
+    daq.setup()
+    n = daq.scan_params['write_chunk_size'] // daq._n_ch
+    capacity = daq._ring.shape[1]
+    n_chunks = 2*capacity // n + 3
+    _feed(daq, n_chunks)
+
+    assert daq._ring.shape[1] > capacity
+    np.testing.assert_array_equal(daq.counts, _samples(4, 0, n_chunks*n))
+
+
+def test_max_dur_wraps(ul):
+    daq = E1608(channels={0: 'a'}, rate=12800, max_dur=0.5)
+    daq.setup()
+    n = daq.scan_params['write_chunk_size'] // daq._n_ch
+    capacity = daq._ring.shape[1]
+    assert capacity == 6400
+    _feed(daq, 12)
+
+    total = 12*n
+    assert daq._ring.shape[1] == capacity
+    assert daq._wpos == total % capacity
+    np.testing.assert_array_equal(daq.counts,
+                                  _samples(2, total - capacity, total))
+
+
+def test_ordered_snapshot(ul):
+    daq = E1608(channels={0: 'a'}, rate=12800)
+    daq.setup()
+    n = daq.scan_params['write_chunk_size'] // daq._n_ch
+    _feed(daq, 3)
+    key = (daq._total_written, daq._wpos)
+    _feed(daq, 2)
+
+    # an older cursor still reads the data as it was then
+    np.testing.assert_array_equal(daq._ordered(*key), _samples(2, 0, 3*n))
+
+
+def test_time_axis_after_wrap(ul):
+    daq = E1608(channels={0: 'a', 1: 'b'}, rate=12800, max_dur=0.5)
+    daq.setup()
+    _feed(daq, 15)
+
+    total = daq._total_written
+    df = daq.df
+    assert len(df) == 6400
+    np.testing.assert_allclose(df.index.values,
+                               np.arange(total - 6400, total)/12800)
+    np.testing.assert_allclose(df.values.T,
+                               daq.to_volts(_samples(4, total - 6400,
+                                                     total)[::2]))
+
+
+def test_cache_keyed_on_cursor(ul):
+    daq = E1608(channels={0: 'a'}, rate=12800)
+    daq.setup()
+    _feed(daq, 2)
+    df = daq.df
+    assert daq.df is df
+
+    # a build that raced a new chunk lands after it: not served again
+    key = (daq._total_written, daq._wpos)
+    columns = daq._get_columns()
+    _feed(daq, 1)
+    daq._columns = (key, columns)
+    daq._df = (key, df)
+
+    assert daq._get_columns()[1].size == daq._total_written
+    assert len(daq.df) == daq._total_written
+
+
+def test_empty_before_start(ul):
+    daq = E1608(channels={0: 'a', 1: 'b'})
+
+    assert daq.df.shape == (0, 2)
+    assert daq.to_volts().shape == (4, 0)
+
+
+def test_board_shared_until_last_close(ul):
+    a = E1608(channels={0: 'a'})
+    b = E1608(channels={0: 'a'})
+    assert ul.created == [0]
+
+    a.close()
+    a.close()
+    assert ul.released == []
+
+    b.setup()
+    memhandle = b.scan_params['memhandle']
+    b.close()
+    assert ul.released == [0]
+    assert memhandle not in ul.buffers
+
+    # setup after close adds the board again
+    b.setup()
+    assert ul.created == [0, 0]
+    b.close()
+
+
+def test_channel_data_cached(ul):
+    daq = E1608(channels={0: 'a'}, rate=12800)
+    daq.setup()
+    _feed(daq, 2)
+    volts = daq.channel_data
+    assert daq.channel_data is volts
+
+    _feed(daq, 1)
+    np.testing.assert_array_equal(daq.channel_data,
+                                  daq.to_volts(_samples(2, 0,
+                                                        daq._total_written)))
+
+
+def test_stream_matches_to_csv(ul, tmp_path):
+    daq = E1608(channels={0: 'T (°C)', 1: 'R (Ω)'}, rate=12800)
+    daq.setup()
+    n = daq.scan_params['write_chunk_size'] // daq._n_ch
+
+    # queue the chunks as the consumer does, and write them out in full
+    daq._write_queue = queue.Queue()
+    for _ in range(3):
+        start = daq._total_written
+        chunk = _samples(4, start, start + n).T.ravel()
+        daq._write_ring(chunk)
+        daq._write_queue.put((start, chunk))
+    daq._write_queue.put(None)
+    daq._stream_to_csv(open(tmp_path / 'stream.csv', 'wb'), '%.6g',
+                       {'wall': 'east'})
+
+    daq.to_csv(tmp_path / 'full.csv', wall='east')
+    assert daq._writer_error is None
+    assert ((tmp_path / 'stream.csv').read_bytes() ==
+            (tmp_path / 'full.csv').read_bytes())
@@ -0,0 +1,79 @@
+"""
+Tests for the hardware-independent kernels in E1608/_kernels.py.
+
+Run with and without numba installed to cover both code paths.
+"""
+
+import numpy as np
+import pytest
+
+from E1608 import _kernels as kernels
+
+
+def _block(n_ch, n):
+    """Samples indexed as [channel, sample], valued channel*100 + sample"""
+    return (np.arange(n_ch)[:, None]*100 +
+            np.arange(n)).astype(np.uint16)
+
+
+def test_copy_chunk_no_wrap():
+    ring = np.zeros((2, 10), dtype=np.uint16)
+    block = _block(2, 4)
+
+    assert kernels.copy_chunk(block, ring, 3) == 7
+    np.testing.assert_array_equal(ring[:, 3:7], block)
+    assert not ring[:, :3].any() and not ring[:, 7:].any()
+
+
+def test_copy_chunk_to_end():
+    ring = np.zeros((2, 10), dtype=np.uint16)
+    block = _block(2, 4)
+
+    assert kernels.copy_chunk(block, ring, 6) == 0
+    np.testing.assert_array_equal(ring[:, 6:], block)
+
+
+def test_copy_chunk_wrap():
+    ring = np.zeros((2, 10), dtype=np.uint16)
+    block = _block(2, 4)
+
+    assert kernels.copy_chunk(block, ring, 8) == 2
+    np.testing.assert_array_equal(ring[:, 8:], block[:, :2])
+    np.testing.assert_array_equal(ring[:, :2], block[:, 2:])
+    assert not ring[:, 2:8].any()
+
+
+@pytest.mark.parametrize('n_ch', [1, 2, 6])
+def test_deinterleave(n_ch):
+    n = 128
+    expected = _block(n_ch, n)
+
+    # interleaved as the device writes it: one scan of every channel at a time
+    chunk = expected.T.ravel()
+    index = kernels.deinterleave_index(chunk.size, n_ch)
+
+    np.testing.assert_array_equal(chunk.take(index).reshape(n_ch, n),
+                                  expected)
+
+
+def test_deinterleave_then_wrap():
+    n_ch, n = 4, 128
+    ring = np.zeros((n_ch, 3*n), dtype=np.uint16)
+    expected = _block(n_ch, n)
+    chunk = expected.T.ravel()
+    index = kernels.deinterleave_index(chunk.size, n_ch)
+
+    block = chunk.take(index).reshape(n_ch, n)
+
+    wpos = kernels.copy_chunk(block, ring, 2*n + 5)
+    assert wpos == 5
+    np.testing.assert_array_equal(
+        np.concatenate([ring[:, 2*n + 5:], ring[:, :5]], axis=1), expected)
+
+
+def test_counts_to_volts():
+    counts = np.array([[0, 1, 0xFFFF], [2, 3, 4]], dtype=np.uint16)
+    volts = kernels.counts_to_volts(counts[:, ::2], 0.5, -1)
+
+    assert volts.dtype == np.float32
+    np.testing.assert_allclose(volts, counts[:, ::2]*0.5 - 1)